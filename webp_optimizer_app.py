@@ -1,11 +1,29 @@
 import streamlit as st
+from streamlit.logger import get_logger
 import subprocess
 import tempfile
 import os
+import math
+import re
+import json
+import hashlib
+import threading
+import time
+from collections import deque
+from fractions import Fraction
 from pathlib import Path
 import shutil
-from PIL import Image
+from PIL import Image, features
 import io
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import av  # PyAV reads container metadata in-process
+except ImportError:
+    av = None
+
+# Streamlit's logger, so messages go out at its configured level
+logger = get_logger(__name__)
 
 st.set_page_config(
     page_title="Media Optimizer",
@@ -13,6 +31,7 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource(show_spinner=False)
 def check_cwebp():
     """Check if cwebp is installed (or if Pillow can handle WebP)."""
     # First try command-line tool (for local use)
@@ -30,6 +49,17 @@ def check_cwebp():
         except:
             return False, None
 
+@st.cache_resource(show_spinner=False)
+def check_pillow_simd():
+    """Check whether Pillow decodes JPEGs with the SIMD libjpeg-turbo backend."""
+    try:
+        accelerated = bool(features.check('libjpeg_turbo'))
+    except ValueError:
+        accelerated = False
+    logger.info("Pillow %s (libjpeg-turbo: %s)", Image.__version__, 'yes' if accelerated else 'no')
+    return accelerated
+
+@st.cache_resource(show_spinner=False)
 def check_ffmpeg():
     """Check if ffmpeg is installed."""
     # Try common locations and PATH
@@ -54,103 +84,520 @@ def check_ffmpeg():
     
     return False
 
-def optimize_webp(input_path, output_path, quality=85, method=6):
-    """Optimize WebP image using Pillow (works on Streamlit Cloud)."""
+# Images get a tighter limit than the 1 GB video cap (server.maxUploadSize in .streamlit/config.toml)
+MAX_IMAGE_BYTES = 200 * 1024 * 1024
+# Larger images are encoded straight from the upload instead of through the memoized copy
+IN_MEMORY_IMAGE_BYTES = 128 * 1024 * 1024
+
+def _encode_webp(fp, quality, method):
+    """Encode an image path or file object to WebP bytes."""
+    output = io.BytesIO()
+    with Image.open(fp) as img:
+        # Convert RGBA to RGB if needed (WebP supports both)
+        if img.mode == 'RGBA':
+            # Keep alpha channel
+            pass
+        elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            # Convert to RGB
+            img = img.convert('RGB')
+        
+        # Save as WebP with optimization
+        # Pillow's quality parameter maps to WebP quality (0-100)
+        # method parameter is not directly supported, but quality works well
+        img.save(
+            output,
+            'WEBP',
+            quality=quality,
+            method=6 if method > 0 else 0,  # Pillow method (0-6)
+            lossless=False
+        )
+    return output.getvalue()
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def encode_webp_bytes(src_bytes: bytes, quality: int, method: int) -> bytes:
+    """Encode image bytes to WebP, memoized on the source bytes and settings."""
+    return _encode_webp(io.BytesIO(src_bytes), quality, method)
+
+@st.cache_resource(show_spinner=False)
+def get_encode_executor():
+    """Shared thread pool for image encodes (Pillow releases the GIL while encoding)."""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+def optimize_webp(src, quality=85, method=6):
+    """Optimize an image (bytes or file object) to WebP bytes using Pillow (works on Streamlit Cloud)."""
     try:
         # Use Pillow for WebP optimization (works everywhere)
-        with Image.open(input_path) as img:
-            # Convert RGBA to RGB if needed (WebP supports both)
-            if img.mode == 'RGBA':
-                # Keep alpha channel
-                pass
-            elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
-                # Convert to RGB
-                img = img.convert('RGB')
-            
-            # Save as WebP with optimization
-            # Pillow's quality parameter maps to WebP quality (0-100)
-            # method parameter is not directly supported, but quality works well
-            img.save(
-                output_path,
-                'WEBP',
-                quality=quality,
-                method=6 if method > 0 else 0,  # Pillow method (0-6)
-                lossless=False
-            )
-        return True, None
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            return encode_webp_bytes(bytes(src), quality, method), None
+        # File objects skip the cache so large uploads aren't copied or kept around
+        src.seek(0)
+        return _encode_webp(src, quality, method), None
     except Exception as e:
-        return False, str(e)
+        return None, str(e)
+
+# Uploads above this size default to the realtime encoding deadline
+REALTIME_DEFAULT_BYTES = 50 * 1024 * 1024
 
-def optimize_video(input_path, output_path, crf=35, speed=4, fps=None):
-    """Optimize WebM video."""
+@st.cache_resource(show_spinner=False)
+def list_ffmpeg_encoders():
+    """List the encoder names ffmpeg was built with."""
     try:
-        # Ensure output is .webm format
-        output_path = Path(output_path)
-        if output_path.suffix.lower() != '.webm':
-            output_path = output_path.with_suffix('.webm')
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=5
+        )
+        return frozenset(line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1)
+    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+        return frozenset()
+
+@st.cache_resource(show_spinner=False)
+def detect_vp9_encoder():
+    """Prefer SVT-VP9 when ffmpeg was built with it, otherwise libvpx-vp9."""
+    if 'libsvt_vp9' in list_ffmpeg_encoders():
+        return 'libsvt_vp9'
+    return 'libvpx-vp9'
+
+# Hardware encoders in order of preference (NVIDIA, Apple, Intel)
+HW_ENCODERS = [
+    'hevc_nvenc',
+    'h264_nvenc',
+    'hevc_videotoolbox',
+    'h264_videotoolbox',
+    'hevc_qsv',
+    'h264_qsv',
+]
+
+@st.cache_resource(show_spinner=False)
+def _hw_encoder_works(encoder):
+    """Check that a hardware encoder can actually encode a frame on this host."""
+    try:
+        subprocess.run(
+            ['ffmpeg', '-hide_banner', '-v', 'error',
+             '-f', 'lavfi', '-i', 'color=s=256x256',
+             '-frames:v', '1',
+             '-c:v', encoder,
+             '-f', 'null', '-'],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            check=True,
+            timeout=10
+        )
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+
+@st.cache_resource(show_spinner=False)
+def detect_hw_encoder():
+    """Find a hardware video encoder ffmpeg can use, if any."""
+    encoders = list_ffmpeg_encoders()
+    for encoder in HW_ENCODERS:
+        # Encoders compiled into ffmpeg are listed even when the GPU/driver is missing
+        if encoder in encoders and _hw_encoder_works(encoder):
+            return encoder
+    return None
+
+def vp9_tile_columns(height=None):
+    """Pick VP9 tile columns (log2) from the available CPU count."""
+    tile_columns = max(0, min(6, int(math.log2(max(1, os.cpu_count() or 1)))))
+    if height and height < 720:
+        # Narrow tiles on small frames cost more quality than they gain in speed
+        tile_columns = min(tile_columns, 1)
+    return tile_columns
+
+# Two-pass never targets more than this fraction of the source bitrate
+SOURCE_BITRATE_CAP = 0.7
+
+def vp9_target_bitrate(crf=35, width=None, height=None, source_bitrate=None):
+    """Estimate a VP9 VBR target (kbps) comparable to the given CRF and resolution."""
+    # ~1500k at CRF 35 for 1080p, doubling for every 6 CRF steps lower
+    kbps = 1500 * 2 ** ((35 - crf) / 6)
+    if width and height:
+        kbps *= (width * height) / (1920 * 1080)
+    kbps = max(100, kbps)
+    if source_bitrate:
+        # Low-bitrate sources would otherwise come out larger than they went in
+        kbps = min(kbps, source_bitrate / 1000 * SOURCE_BITRATE_CAP)
+    return max(1, round(kbps))
+
+def vp9_video_args(crf=35, speed=4, deadline='good', bitrate=None, height=None):
+    """Build the ffmpeg video codec arguments for the detected VP9 encoder."""
+    # A bitrate (kbps) switches to libvpx-vp9 VBR for two-pass encoding
+    encoder = 'libvpx-vp9' if bitrate else detect_vp9_encoder()
+    if encoder == 'libsvt_vp9':
+        # SVT-VP9 uses constant QP and presets (0-9, higher = faster) instead of CRF/speed
+        preset = 9 if deadline == 'realtime' else min(9, speed + 4)
+        return [
+            '-c:v', 'libsvt_vp9',
+            '-rc', '0',
+            '-qp', str(crf),
+            '-preset', str(preset),
+        ]
+    
+    if deadline == 'realtime' and not bitrate:
+        # Fastest libvpx mode, trades a little efficiency for much shorter encodes
+        speed_args = [
+            '-deadline', 'realtime',
+            '-cpu-used', '8',
+            '-lag-in-frames', '0',
+            '-error-resilient', '1',
+        ]
+    else:
+        speed_args = [
+            '-deadline', 'good',
+            '-speed', str(speed),
+            '-auto-alt-ref', '1',
+            '-lag-in-frames', '25',
+        ]
+    rate_args = ['-b:v', f'{bitrate}k'] if bitrate else ['-crf', str(crf), '-b:v', '0']
+    return [
+        '-c:v', 'libvpx-vp9',
+        *rate_args,
+        *speed_args,
+        '-row-mt', '1',
+        '-tile-columns', str(vp9_tile_columns(height)),
+    ]
+
+# Opus VBR audio for WebM output
+OPUS_AUDIO_ARGS = ['-c:a', 'libopus', '-b:a', '96k', '-vbr', 'on', '-application', 'audio']
+
+# Matches the "time=HH:MM:SS.xx" field of ffmpeg's frame= progress lines
+FFMPEG_TIME_RE = re.compile(r'time=(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+def run_ffmpeg(cmd, total_seconds=None, on_progress=None, cancel=None, tail_lines=200):
+    """Run ffmpeg keeping only the tail of stderr, reporting progress as a 0-1 fraction."""
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,  # universal newlines also split ffmpeg's \r progress updates
+        errors='replace'
+    )
+    tail = deque(maxlen=tail_lines)
+    state = {'seconds': 0.0}
+    
+    def drain_stderr():
+        for line in iter(process.stderr.readline, ''):
+            line = line.rstrip()
+            tail.append(line)
+            match = FFMPEG_TIME_RE.search(line) if line.startswith('frame=') else None
+            if match:
+                hours, minutes, seconds = match.groups()
+                state['seconds'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    
+    reader = threading.Thread(target=drain_stderr, daemon=True)
+    reader.start()
+    
+    try:
+        # Streamlit elements must be updated from the script thread, so poll here
+        while process.poll() is None:
+            if cancel is not None and cancel.is_set():
+                # Falls through to the kill below
+                break
+            if on_progress and total_seconds:
+                on_progress(min(1.0, state['seconds'] / total_seconds))
+            time.sleep(0.25)
+    finally:
+        # A cancel, or a rerun/stop raised from on_progress, must not leave ffmpeg running
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        reader.join()
+        process.stderr.close()
+    
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr='\n'.join(tail))
+
+def _encode_segment(input_path, output_path, crf=35, speed=4, fps=None, deadline='good',
+                    threads=0, audio=True, total_seconds=None, on_progress=None, height=None,
+                    cancel=None):
+    """Encode one input (a whole video or a pre-split segment) to WebM."""
+    cmd = ['ffmpeg', '-i', str(input_path)]
+    
+    # Add FPS filter if specified
+    if fps:
+        cmd += ['-vf', f'fps={fps}']
+    
+    cmd += [
+        *vp9_video_args(crf=crf, speed=speed, deadline=deadline, height=height),
+        '-threads', str(threads),
+    ]
+    if audio:
+        cmd += OPUS_AUDIO_ARGS
+    else:
+        cmd += ['-an']
+    cmd += [
+        '-map_metadata', '-1',  # Strip container metadata
+        '-f', 'webm',  # Explicitly specify WebM format
+        '-y',
+        str(output_path)
+    ]
+    
+    run_ffmpeg(cmd, total_seconds=total_seconds, on_progress=on_progress, cancel=cancel)
+
+def _parallel_encode(input_path, output_path, crf=35, speed=4, fps=None, deadline='good',
+                     segment_time=10, on_progress=None, height=None):
+    """Split the video into segments, encode them concurrently and concatenate the results."""
+    cpus = os.cpu_count() or 1
+    workers = max(1, cpus // 4)
+    threads = max(1, cpus // workers)
+    
+    with tempfile.TemporaryDirectory() as seg_dir:
+        seg_dir = Path(seg_dir)
         
-        cmd = [
+        # Split the video stream at keyframes without re-encoding (Matroska accepts any codec)
+        run_ffmpeg([
             'ffmpeg', '-i', str(input_path),
-            '-c:v', 'libvpx-vp9',
-            '-crf', str(crf),
-            '-b:v', '0',
-            '-speed', str(speed),
-            '-row-mt', '1',
-            '-tile-columns', '2',
-            '-tile-rows', '1',
-            '-frame-parallel', '1',
-            '-threads', '0',
-            '-c:a', 'libopus',
-            '-b:a', '96k',
-            '-f', 'webm',  # Explicitly specify WebM format
+            '-map', '0:v:0',
+            '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', str(segment_time),
+            '-reset_timestamps', '1',
+            '-y',
+            str(seg_dir / 'seg_%03d.mkv')
+        ])
+        segments = sorted(seg_dir.glob('seg_*.mkv'))
+        
+        # ffmpeg does the heavy lifting, so threads are enough to keep the encoders busy
+        encoded = [seg.with_suffix('.webm') for seg in segments]
+        cancel = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=workers)
+        futures = []
+        try:
+            futures += [
+                pool.submit(_encode_segment, seg, out, crf=crf, speed=speed, fps=fps,
+                            deadline=deadline, threads=threads, audio=False, height=height,
+                            cancel=cancel)
+                for seg, out in zip(segments, encoded)
+            ]
+            pending = set(futures)
+            while pending:
+                # Poll so the progress update (where Streamlit raises rerun/stop) runs regularly
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                if on_progress:
+                    on_progress((len(futures) - len(pending)) / len(futures))
+        except BaseException:
+            # Kill running segment encodes and skip the rest after a failure or rerun
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+            raise
+        pool.shutdown()
+        
+        concat_list = seg_dir / 'list.txt'
+        concat_list.write_text(''.join(f"file '{out}'\n" for out in encoded))
+        
+        # Join the encoded segments and encode the audio once from the original input
+        run_ffmpeg([
+            'ffmpeg',
+            '-f', 'concat', '-safe', '0', '-i', str(concat_list),
+            '-i', str(input_path),
+            '-map', '0:v', '-map', '1:a?',
+            '-c:v', 'copy',
+            *OPUS_AUDIO_ARGS,
+            '-map_metadata', '-1',
+            '-f', 'webm',
             '-y',
             str(output_path)
-        ]
+        ])
+
+def _hw_encode(input_path, output_path, encoder, crf=35, fps=None, total_seconds=None, on_progress=None):
+    """Encode to MP4 with a hardware encoder (NVENC, VideoToolbox or Quick Sync)."""
+    # Map the VP9 CRF scale (0-63) onto the H.264/HEVC quantizer scale (0-51)
+    quality = round(crf * 51 / 63)
+    
+    cmd = ['ffmpeg']
+    if encoder.endswith('_nvenc'):
+        # Keep decoded frames on the GPU
+        cmd += ['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda']
+    cmd += ['-i', str(input_path)]
+    
+    # Add FPS filter if specified
+    if fps:
+        cmd += ['-vf', f'fps={fps}']
+    
+    cmd += ['-c:v', encoder]
+    if encoder.endswith('_nvenc'):
+        cmd += ['-preset', 'p5', '-rc', 'vbr', '-cq', str(quality), '-b:v', '0']
+    elif encoder.endswith('_videotoolbox'):
+        # VideoToolbox quality runs 1-100, higher is better
+        cmd += ['-q:v', str(max(1, 100 - 2 * quality))]
+    else:
+        cmd += ['-global_quality', str(quality)]
+    if encoder.startswith('hevc_'):
+        # Tag HEVC so Apple players accept it in MP4
+        cmd += ['-tag:v', 'hvc1']
+    
+    cmd += [
+        '-c:a', 'aac',
+        '-b:a', '128k',
+        '-movflags', '+faststart',
+        '-map_metadata', '-1',
+        '-f', 'mp4',
+        '-y',
+        str(output_path)
+    ]
+    
+    run_ffmpeg(cmd, total_seconds=total_seconds, on_progress=on_progress)
+
+def _two_pass_encode(input_path, output_path, bitrate, speed=4, fps=None, total_seconds=None,
+                     on_progress=None, height=None):
+    """Encode to WebM with two-pass libvpx-vp9 VBR at the given bitrate (kbps)."""
+    def pass_progress(offset):
+        # Each pass covers half of the progress bar
+        return (lambda fraction: on_progress(offset + fraction / 2)) if on_progress else None
+    
+    input_args = ['ffmpeg', '-i', str(input_path)]
+    # Add FPS filter if specified
+    if fps:
+        input_args += ['-vf', f'fps={fps}']
+    
+    with tempfile.TemporaryDirectory() as log_dir:
+        passlog = str(Path(log_dir) / 'vp9')
         
-        # Add FPS filter if specified
-        if fps:
-            # Insert fps filter before codec
-            cmd.insert(2, '-vf')
-            cmd.insert(3, f'fps={fps}')
+        # First pass only gathers statistics, so run it at speed 4 or faster
+        run_ffmpeg([
+            *input_args,
+            *vp9_video_args(speed=max(speed, 4), bitrate=bitrate, height=height),
+            '-threads', '0',
+            '-pass', '1',
+            '-passlogfile', passlog,
+            '-an',
+            '-f', 'null',
+            '-y',
+            os.devnull
+        ], total_seconds=total_seconds, on_progress=pass_progress(0.0))
         
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        run_ffmpeg([
+            *input_args,
+            *vp9_video_args(speed=speed, bitrate=bitrate, height=height),
+            '-threads', '0',
+            '-pass', '2',
+            '-passlogfile', passlog,
+            *OPUS_AUDIO_ARGS,
+            '-map_metadata', '-1',
+            '-f', 'webm',
+            '-y',
+            str(output_path)
+        ], total_seconds=total_seconds, on_progress=pass_progress(0.5))
+
+def optimize_video(input_path, output_path, crf=35, speed=4, fps=None, deadline='good', parallel=False,
+                   total_seconds=None, on_progress=None, hw_encoder=None, two_pass=False,
+                   target_bitrate=None, height=None):
+    """Optimize video to WebM (VP9), or to MP4 when a hardware encoder is given."""
+    try:
+        # Ensure output is .webm format (.mp4 for the hardware path)
+        output_path = Path(output_path)
+        suffix = '.mp4' if hw_encoder else '.webm'
+        if output_path.suffix.lower() != suffix:
+            output_path = output_path.with_suffix(suffix)
+        
+        if hw_encoder:
+            _hw_encode(input_path, output_path, hw_encoder, crf=crf, fps=fps,
+                       total_seconds=total_seconds, on_progress=on_progress)
+        elif two_pass:
+            _two_pass_encode(input_path, output_path, target_bitrate or vp9_target_bitrate(crf),
+                             speed=speed, fps=fps, total_seconds=total_seconds, on_progress=on_progress,
+                             height=height)
+        elif parallel:
+            _parallel_encode(input_path, output_path, crf=crf, speed=speed, fps=fps, deadline=deadline,
+                             on_progress=on_progress, height=height)
+        else:
+            _encode_segment(input_path, output_path, crf=crf, speed=speed, fps=fps, deadline=deadline,
+                            total_seconds=total_seconds, on_progress=on_progress, height=height)
         return True, None
     except subprocess.CalledProcessError as e:
         error_msg = e.stderr if e.stderr else str(e)
         return False, error_msg
 
+def _get_video_info_av(video_path):
+    """Get video information from the container header with PyAV."""
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        return {
+            'width': stream.width,
+            'height': stream.height,
+            'fps': round(float(stream.average_rate), 2) if stream.average_rate else None,
+            'duration': container.duration / av.time_base if container.duration else None,
+            'bitrate': container.bit_rate
+        }
+
+def _parse_number(value, cast=float):
+    """Convert an ffprobe field, returning None when it is missing or 'N/A'."""
+    try:
+        return cast(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+def _get_video_info_ffprobe(video_path):
+    """Get video information from ffprobe's JSON output."""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,r_frame_rate,duration,bit_rate:format=duration,bit_rate',
+        '-of', 'json',
+        str(video_path)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    probe = json.loads(result.stdout)
+    stream = probe['streams'][0]
+    # WebM streams often omit duration/bitrate, the container level has them
+    container = probe.get('format', {})
+    fps = _parse_number(stream.get('r_frame_rate'), Fraction)
+    return {
+        'width': _parse_number(stream.get('width'), int),
+        'height': _parse_number(stream.get('height'), int),
+        'fps': round(float(fps), 2) if fps else None,
+        'duration': _parse_number(stream.get('duration')) or _parse_number(container.get('duration')),
+        'bitrate': _parse_number(stream.get('bit_rate'), int) or _parse_number(container.get('bit_rate'), int)
+    }
+
+def _file_fingerprint(path, head=1 << 16):
+    """Identify a file by its size and leading bytes, independent of where it was written."""
+    path = Path(path)
+    with open(path, 'rb') as f:
+        return path.stat().st_size, hashlib.sha1(f.read(head)).hexdigest()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _cached_video_info(_video_path, fingerprint):
+    """Probe a video once per distinct file (the leading underscore keeps the path out of the cache key)."""
+    if av is not None:
+        try:
+            return _get_video_info_av(_video_path)
+        except Exception:
+            # Fall back to ffprobe for anything PyAV can't read
+            pass
+    try:
+        return _get_video_info_ffprobe(_video_path)
+    except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError, KeyError, IndexError):
+        return None
+
 def get_video_info(video_path):
     """Get video information."""
-    try:
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height,r_frame_rate,duration,bit_rate',
-            '-of', 'csv=p=0',
-            str(video_path)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        parts = result.stdout.strip().split(',')
-        if len(parts) >= 4:
-            return {
-                'width': int(parts[0]) if parts[0] else None,
-                'height': int(parts[1]) if parts[1] else None,
-                'fps': parts[2] if parts[2] else None,
-                'duration': float(parts[3]) if len(parts) > 3 and parts[3] else None,
-                'bitrate': int(parts[4]) if len(parts) > 4 and parts[4] else None
-            }
-    except:
-        pass
-    return None
+    # Uploads are re-saved to a fresh temp path on every rerun, so key the cache on the content
+    return _cached_video_info(video_path, _file_fingerprint(video_path))
+
+def save_upload(uploaded_file, dst, chunk=1 << 20):
+    """Stream an uploaded file to disk in fixed-size chunks."""
+    uploaded_file.seek(0)
+    with open(dst, 'wb') as f:
+        shutil.copyfileobj(uploaded_file, f, length=chunk)
+    uploaded_file.seek(0)
+
+# (unit, log2 of the unit size) indexed by bit_length() // 10
+SIZE_UNITS = (('B', 0), ('KB', 10), ('MB', 20), ('GB', 30))
 
 def format_size(size_bytes):
     """Format file size in human readable format."""
-    if size_bytes < 1024:
-        return f"{size_bytes} B"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.2f} KB"
-    else:
-        return f"{size_bytes / (1024 * 1024):.2f} MB"
+    index = min(max(0, (size_bytes.bit_length() - 1) // 10), len(SIZE_UNITS) - 1)
+    unit, shift = SIZE_UNITS[index]
+    return f"{size_bytes / (1 << shift):.2f} {unit}" if shift else f"{size_bytes} B"
 
 # Main app
 st.title("🎬 Media Optimizer")
@@ -167,9 +614,13 @@ with tab1:
     # Check if WebP optimization is available
     webp_available, method = check_cwebp()
     if not webp_available:
+        # Don't keep a failed probe cached so a refresh checks again
+        check_cwebp.clear()
         st.error("⚠️ WebP support is not available. Please install Pillow:")
         st.code("pip install Pillow", language="bash")
     else:
+        if check_pillow_simd():
+            st.caption("⚡ SIMD accelerated image decoding (libjpeg-turbo)")
         # Sidebar for image settings
         with st.sidebar:
             st.header("⚙️ Image Settings")
@@ -198,107 +649,117 @@ with tab1:
             key="image_upload"
         )
         
-        if uploaded_file is not None:
-            # Create temporary files
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_input = Path(temp_dir) / uploaded_file.name
-                temp_output = Path(temp_dir) / f"optimized_{uploaded_file.name}"
-                
-                # Save uploaded file
-                with open(temp_input, 'wb') as f:
-                    f.write(uploaded_file.getbuffer())
-                
-                # Get original file size
-                original_size = temp_input.stat().st_size
-                
-                # Display original image info
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.subheader("📤 Original Image")
-                    st.image(uploaded_file)
-                    st.info(f"**Size:** {format_size(original_size)}")
-                
-                # Optimize button
-                if st.button("🚀 Optimize Image", type="primary", key="optimize_img"):
-                    with st.spinner("Optimizing image... This may take a moment."):
-                        success, error = optimize_webp(temp_input, temp_output, quality=quality, method=method)
+        if uploaded_file is not None and uploaded_file.size > MAX_IMAGE_BYTES:
+            st.error(f"❌ Image is too large ({format_size(uploaded_file.size)}). The limit is {format_size(MAX_IMAGE_BYTES)}.")
+        elif uploaded_file is not None:
+            # Work from the uploaded bytes, no temp files needed
+            original_size = uploaded_file.size
+            
+            # Display original image info
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.subheader("📤 Original Image")
+                st.image(uploaded_file)
+                st.info(f"**Size:** {format_size(original_size)}")
+            
+            # Optimize button
+            if st.button("🚀 Optimize Image", type="primary", key="optimize_img"):
+                with st.spinner("Optimizing image... This may take a moment."):
+                    # Encode off the script thread so the page stays responsive
+                    # Very large images are decoded from the upload itself rather than a cached copy
+                    src = uploaded_file if original_size > IN_MEMORY_IMAGE_BYTES else uploaded_file.getvalue()
+                    future = get_encode_executor().submit(
+                        optimize_webp, src, quality=quality, method=method
+                    )
+                    status = st.empty()
+                    started = time.monotonic()
+                    while not future.done():
+                        status.caption(f"Encoding... {time.monotonic() - started:.1f}s")
+                        time.sleep(0.1)
+                    status.empty()
+                    optimized_bytes, error = future.result()
+                    
+                    if optimized_bytes is not None:
+                        optimized_size = len(optimized_bytes)
+                        reduction = ((1 - optimized_size / original_size) * 100) if original_size > 0 else 0
                         
-                        if success and temp_output.exists():
-                            optimized_size = temp_output.stat().st_size
-                            reduction = ((1 - optimized_size / original_size) * 100) if original_size > 0 else 0
+                        with col2:
+                            st.subheader("📥 Optimized Image")
                             
-                            with col2:
-                                st.subheader("📥 Optimized Image")
-                                
-                                # Read and display optimized image
-                                with open(temp_output, 'rb') as f:
-                                    optimized_bytes = f.read()
-                                st.image(optimized_bytes)
-                                
-                                st.success(f"**Size:** {format_size(optimized_size)}")
-                                
-                                # Size reduction info
-                                if optimized_size < original_size:
-                                    st.success(f"✅ **Reduction:** {reduction:.1f}% smaller")
-                                    st.metric(
-                                        "Size Saved",
-                                        f"-{format_size(original_size - optimized_size)}",
-                                        f"{reduction:.1f}%"
-                                    )
-                                else:
-                                    st.warning("⚠️ File size increased. Try lower quality settings.")
-                            
-                            # Download button
-                            st.markdown("---")
-                            output_filename = f"optimized_{Path(uploaded_file.name).stem}.webp"
-                            st.download_button(
-                                label="⬇️ Download Optimized Image",
-                                data=optimized_bytes,
-                                file_name=output_filename,
-                                mime="image/webp",
-                                key="download_img"
-                            )
+                            # Display optimized image straight from memory
+                            st.image(optimized_bytes)
                             
-                            # Comparison chart
-                            st.markdown("---")
-                            st.subheader("📊 Size Comparison")
+                            st.success(f"**Size:** {format_size(optimized_size)}")
                             
-                            comparison_data = {
-                                'Original': original_size,
-                                'Optimized': optimized_size
-                            }
-                            st.bar_chart(comparison_data)
+                            # Size reduction info
+                            if optimized_size < original_size:
+                                st.success(f"✅ **Reduction:** {reduction:.1f}% smaller")
+                                st.metric(
+                                    "Size Saved",
+                                    f"-{format_size(original_size - optimized_size)}",
+                                    f"{reduction:.1f}%"
+                                )
+                            else:
+                                st.warning("⚠️ File size increased. Try lower quality settings.")
+                        
+                        # Download button
+                        st.markdown("---")
+                        output_filename = f"optimized_{Path(uploaded_file.name).stem}.webp"
+                        st.download_button(
+                            label="⬇️ Download Optimized Image",
+                            data=optimized_bytes,
+                            file_name=output_filename,
+                            mime="image/webp",
+                            key="download_img"
+                        )
+                        
+                        # Comparison chart
+                        st.markdown("---")
+                        st.subheader("📊 Size Comparison")
+                        
+                        comparison_data = {
+                            'Original': original_size,
+                            'Optimized': optimized_size
+                        }
+                        st.bar_chart(comparison_data)
+                        
+                        # Detailed stats
+                        with st.expander("📈 Detailed Statistics"):
+                            col_a, col_b, col_c = st.columns(3)
+                            with col_a:
+                                st.metric("Original Size", format_size(original_size))
+                            with col_b:
+                                st.metric("Optimized Size", format_size(optimized_size))
+                            with col_c:
+                                st.metric("Reduction", f"{reduction:.1f}%")
                             
-                            # Detailed stats
-                            with st.expander("📈 Detailed Statistics"):
-                                col_a, col_b, col_c = st.columns(3)
-                                with col_a:
-                                    st.metric("Original Size", format_size(original_size))
-                                with col_b:
-                                    st.metric("Optimized Size", format_size(optimized_size))
-                                with col_c:
-                                    st.metric("Reduction", f"{reduction:.1f}%")
-                                
-                                st.markdown(f"""
-                                - **Quality Setting:** {quality}
-                                - **Compression Method:** {method}
-                                - **Size Saved:** {format_size(original_size - optimized_size)}
-                                - **Compression Ratio:** {optimized_size / original_size:.2%}
-                                """)
-                        else:
-                            st.error(f"❌ Optimization failed: {error}")
-                            if error:
-                                st.code(error)
+                            st.markdown(f"""
+                            - **Quality Setting:** {quality}
+                            - **Compression Method:** {method}
+                            - **Size Saved:** {format_size(original_size - optimized_size)}
+                            - **Compression Ratio:** {optimized_size / original_size:.2%}
+                            """)
+                    else:
+                        st.error(f"❌ Optimization failed: {error}")
+                        if error:
+                            st.code(error)
 
 # ========== VIDEO TAB ==========
 with tab2:
     st.markdown("Upload a video to optimize it for smaller file size.")
-    st.markdown("**Supports:** WebM, MP4, MOV → Optimized WebM output")
+    # The hardware path writes MP4 instead of WebM
+    output_formats = "WebM (or MP4 with hardware acceleration)" if detect_hw_encoder() else "WebM"
+    st.markdown(f"**Supports:** WebM, MP4, MOV → Optimized {output_formats} output")
     
     # Check if ffmpeg is installed
     ffmpeg_available = check_ffmpeg()
     if not ffmpeg_available:
+        # Don't keep a failed probe cached so a refresh picks up a fresh install
+        check_ffmpeg.clear()
+        list_ffmpeg_encoders.clear()
+        detect_vp9_encoder.clear()
+        detect_hw_encoder.clear()
         st.warning("⚠️ **Video optimization requires ffmpeg**")
         st.info("""
         **Status:** ffmpeg is being installed via `packages.txt`. If you just deployed, please wait a moment and refresh the page.
@@ -318,6 +779,8 @@ with tab2:
         st.info("💡 **Note:** You can still upload videos, but optimization will fail until ffmpeg is available.")
     else:
         st.success("✅ Video optimization is available!")
+        if detect_vp9_encoder() == 'libsvt_vp9':
+            st.caption("⚡ Using the SVT-VP9 encoder")
         # Sidebar for video settings
         with st.sidebar:
             st.header("⚙️ Video Settings")
@@ -330,12 +793,50 @@ with tab2:
                 help="Lower CRF = higher quality but larger file. 35 is good for compression."
             )
             
+            hw_encoder = detect_hw_encoder()
+            use_hw = False
+            if hw_encoder:
+                use_hw = st.checkbox(
+                    "Hardware acceleration",
+                    value=False,
+                    help=f"Encode with {hw_encoder} on the GPU/media engine. Much faster, outputs MP4 instead of WebM."
+                )
+            
+            two_pass = st.checkbox(
+                "Best compression (2-pass)",
+                value=False,
+                disabled=use_hw,
+                help="Two-pass VBR with libvpx-vp9. Takes roughly twice as long but gives smaller files at the same quality. Ignores Encoding Mode and Parallel encode."
+            ) and not use_hw
+            
+            # Large uploads default to realtime so the encode finishes in reasonable time
+            pending_video = st.session_state.get("video_upload")
+            large_upload = pending_video is not None and pending_video.size > REALTIME_DEFAULT_BYTES
+            deadline = st.radio(
+                "Encoding Mode",
+                options=['realtime', 'good'],
+                format_func=lambda d: "Fast (realtime)" if d == 'realtime' else "Quality (good)",
+                index=0 if large_upload else 1,
+                disabled=use_hw or two_pass,
+                help="Realtime encodes several times faster with slightly larger files. Defaults to realtime for files over 50 MB."
+            )
+            
+            # Two-pass always runs libvpx in good mode, so it uses the speed setting too
+            uses_speed = not use_hw and (two_pass or deadline == 'good')
             speed = st.slider(
                 "Encoding Speed",
                 min_value=0,
                 max_value=5,
                 value=4,
-                help="Higher speed = faster encoding but slightly less efficient. 4 is a good balance."
+                disabled=not uses_speed,
+                help="Higher speed = faster encoding but slightly less efficient. 4 is a good balance. Used in Quality mode and 2-pass."
+            )
+            
+            parallel = st.checkbox(
+                "Parallel encode",
+                value=False,
+                disabled=use_hw or two_pass,
+                help="Split the video into 10s segments and encode them concurrently. Only helps on hosts with many CPU cores."
             )
             
             fps_limit = st.checkbox("Limit FPS to 30", value=False, help="Reduce frame rate to 30 FPS for smaller file size")
@@ -355,21 +856,18 @@ with tab2:
             key="video_upload"
         )
         
+        # Streamlit itself rejects videos above server.maxUploadSize
         if uploaded_video is not None:
-            # Re-check ffmpeg availability (in case it was just installed)
-            if not check_ffmpeg():
-                st.error("❌ ffmpeg is not available. Please wait for installation to complete or use image optimization instead.")
-                st.stop()
             # Create temporary files
             with tempfile.TemporaryDirectory() as temp_dir:
                 temp_input = Path(temp_dir) / uploaded_video.name
-                # Ensure output is always .webm format
-                output_name = Path(uploaded_video.name).stem + '.webm'
+                # Output is .webm, or .mp4 when hardware encoding
+                output_ext, output_mime = ('.mp4', 'video/mp4') if use_hw else ('.webm', 'video/webm')
+                output_name = Path(uploaded_video.name).stem + output_ext
                 temp_output = Path(temp_dir) / f"optimized_{output_name}"
                 
                 # Save uploaded file
-                with open(temp_input, 'wb') as f:
-                    f.write(uploaded_video.getbuffer())
+                save_upload(uploaded_video, temp_input)
                 
                 # Get original file size
                 original_size = temp_input.stat().st_size
@@ -385,35 +883,46 @@ with tab2:
                     st.info(f"**Size:** {format_size(original_size)}")
                     
                     if video_info:
+                        # Fields can be present but None (e.g. MediaRecorder WebM has no duration)
+                        duration = video_info.get('duration')
                         st.info(f"""
                         **Video Info:**
-                        - Resolution: {video_info.get('width', '?')}x{video_info.get('height', '?')}
-                        - FPS: {video_info.get('fps', '?')}
-                        - Duration: {video_info.get('duration', 0):.1f}s
+                        - Resolution: {video_info.get('width') or '?'}x{video_info.get('height') or '?'}
+                        - FPS: {video_info.get('fps') or '?'}
+                        - Duration: {f'{duration:.1f}s' if duration else '?'}
                         """)
                 
                 # Optimize button
                 if st.button("🚀 Optimize Video", type="primary", key="optimize_vid"):
                     with st.spinner("Optimizing video... This may take several minutes depending on video length."):
-                        success, error = optimize_video(temp_input, temp_output, crf=crf, speed=speed, fps=target_fps)
+                        progress_bar = st.progress(0.0)
+                        success, error = optimize_video(
+                            temp_input, temp_output,
+                            crf=crf, speed=speed, fps=target_fps, deadline=deadline, parallel=parallel,
+                            total_seconds=video_info.get('duration') if video_info else None,
+                            on_progress=progress_bar.progress,
+                            hw_encoder=hw_encoder if use_hw else None,
+                            two_pass=two_pass,
+                            target_bitrate=vp9_target_bitrate(
+                                crf,
+                                video_info.get('width') if video_info else None,
+                                video_info.get('height') if video_info else None,
+                                video_info.get('bitrate') if video_info else None
+                            ),
+                            height=video_info.get('height') if video_info else None
+                        )
+                        progress_bar.empty()
                         
                         if success and temp_output.exists():
-                            optimized_size = temp_output.stat().st_size
+                            # Read once; st.video and the download button share this copy in the media store
+                            optimized_bytes = temp_output.read_bytes()
+                            optimized_size = len(optimized_bytes)
                             reduction = ((1 - optimized_size / original_size) * 100) if original_size > 0 else 0
                             
                             with col2:
                                 st.subheader("📥 Optimized Video")
                                 
-                                # Read and display optimized video
-                                with open(temp_output, 'rb') as f:
-                                    optimized_bytes = f.read()
-                                
-                                # Save to temp file for video display
-                                temp_video_display = Path(temp_dir) / "display_video.webm"
-                                with open(temp_video_display, 'wb') as f:
-                                    f.write(optimized_bytes)
-                                
-                                st.video(str(temp_video_display))
+                                st.video(optimized_bytes, format=output_mime)
                                 
                                 st.success(f"**Size:** {format_size(optimized_size)}")
                                 
@@ -430,12 +939,12 @@ with tab2:
                             
                             # Download button
                             st.markdown("---")
-                            output_filename = f"optimized_{Path(uploaded_video.name).stem}.webm"
+                            output_filename = f"optimized_{output_name}"
                             st.download_button(
                                 label="⬇️ Download Optimized Video",
                                 data=optimized_bytes,
                                 file_name=output_filename,
-                                mime="video/webm",
+                                mime=output_mime,
                                 key="download_vid"
                             )
                             
@@ -461,7 +970,9 @@ with tab2:
                                 
                                 st.markdown(f"""
                                 - **CRF Setting:** {crf}
-                                - **Encoding Speed:** {speed}
+                                - **Encoding Mode:** {hw_encoder if use_hw else 'good (2-pass)' if two_pass else deadline}
+                                - **Encoding Speed:** {speed if uses_speed else 'n/a'}
+                                - **Two-pass:** {'Yes' if two_pass else 'No'}
                                 - **FPS Limit:** {target_fps if target_fps else 'None'}
                                 - **Size Saved:** {format_size(original_size - optimized_size)}
                                 - **Compression Ratio:** {optimized_size / original_size:.2%}
@@ -473,10 +984,11 @@ with tab2:
 
 # Footer
 st.markdown("---")
+codecs = "WebP, VP9 & H.264/HEVC" if detect_hw_encoder() else "WebP & VP9"
 st.markdown(
-    """
+    f"""
     <div style='text-align: center; color: #666;'>
-        <p>Powered by WebP & VP9 compression • Optimize media without losing quality</p>
+        <p>Powered by {codecs} compression • Optimize media without losing quality</p>
     </div>
     """,
     unsafe_allow_html=True